@@ -14,9 +14,16 @@ import numpy as np
 import pandas as pd
 import streamlit as st
 
+# Copy-on-write (pandas 2.x): escritas em frames derivados só copiam as
+# colunas tocadas, permitindo evitar cópias integrais dos uploads.
+pd.set_option("mode.copy_on_write", True)
+
 APP_TITLE = "Sylv Inventário — Processamento Completo"
 LOGO_PATH = "assets/sylv_logo.png"   # coloque sua imagem aqui (PNG/SVG)
 
+# Área basal: π * ((DAP/100)/2)² = (π/40000) * DAP² — constante pré-computada
+K_G = math.pi / 40000.0
+
 # -----------------------------------------------------------------------------
 # Configuração de página + branding
 # -----------------------------------------------------------------------------
@@ -36,16 +43,19 @@ except Exception:
     except Exception:
         st.write(":deciduous_tree: ")
 
-# Cabeçalho
-st.markdown(
-    f"""
+# Cabeçalho — o HTML é montado uma única vez por sessão (cache_resource);
+# o rerun só repassa a string pronta ao st.markdown.
+@st.cache_resource
+def _header_html() -> str:
+    return f"""
     <div style="margin-top:-6px">
       <h1 style="font-weight:800; margin-bottom:0">{APP_TITLE}</h1>
       <p style="opacity:0.8; margin-top:4px">Versão 3.0 — Processa DAP (via DAP ou CAP/π), g, Volume (com Hc), Escore Z (opcional) e Indicadores por Nível.</p>
     </div>
-    """,
-    unsafe_allow_html=True,
-)
+    """
+
+
+st.markdown(_header_html(), unsafe_allow_html=True)
 
 # -----------------------------------------------------------------------------
 # Sidebar — parâmetros
@@ -82,6 +92,26 @@ file = st.file_uploader("Arraste/solte ou clique em 'Browse files'", type=["xlsx
 # Funções utilitárias
 # -----------------------------------------------------------------------------
 
+# Engine de leitura: python-calamine (Rust) é bem mais rápido que o openpyxl;
+# se não estiver instalado, cai no engine padrão do pandas.
+try:
+    import python_calamine  # noqa: F401
+
+    _EXCEL_ENGINE = "calamine"
+except ImportError:
+    _EXCEL_ENGINE = None
+
+
+@st.cache_data(show_spinner=False)
+def load_xlsx(file_bytes: bytes) -> dict:
+    """Lê todas as abas do .xlsx; memoizado por conteúdo do arquivo.
+
+    Evita re-parsear o Excel a cada rerun do Streamlit — interações com
+    widgets passam a reutilizar o resultado em memória.
+    """
+    return pd.read_excel(io.BytesIO(file_bytes), sheet_name=None, engine=_EXCEL_ENGINE)
+
+
 def _first_sheet_or_named(df_dict: dict, preferred_names=("Dados_Básicos", "dados_básicos", "dados_basicos")) -> pd.DataFrame:
     """Retorna o DataFrame da primeira planilha ou uma com nome preferido, se existir."""
     for name in preferred_names:
@@ -97,11 +127,27 @@ def _to_float(series):
     return pd.to_numeric(series, errors="coerce")
 
 
+def vol_vec(dap, h):
+    """Volume (m³) vetorizado: 1,3332 * ((DAP/100) ** 2,0836) * (h ** 0,732).
+
+    Opera sobre arrays NumPy inteiros (ufuncs em C, sem loop Python por linha)
+    e devolve NaN onde DAP/h são inválidos ou h <= 0.
+    """
+    dap = np.asarray(dap, dtype=float)
+    h = np.asarray(h, dtype=float)
+    valido = (h > 0) & np.isfinite(dap) & np.isfinite(h)
+    with np.errstate(invalid="ignore"):
+        return np.where(valido, 1.3332 * (dap / 100.0) ** 2.0836 * h ** 0.732, np.nan)
+
+
 def process_dataframe(df_raw: pd.DataFrame) -> pd.DataFrame:
-    """Valida colunas, padroniza e calcula DAP, g e Volume com Hc."""
+    """Valida colunas, padroniza e calcula DAP, g e Volume com Hc.
+
+    Levanta ValueError em caso de planilha inválida (tratado na execução),
+    o que mantém a função livre de chamadas `st.*` e segura para cache.
+    """
     if df_raw.empty:
-        st.error("Planilha vazia.")
-        st.stop()
+        raise ValueError("Planilha vazia.")
 
     # Mapa lower->original
     lower_map = {c.lower().strip(): c for c in df_raw.columns}
@@ -115,13 +161,13 @@ def process_dataframe(df_raw: pd.DataFrame) -> pd.DataFrame:
 
     # Regras
     if not col_hc:
-        st.error("A planilha precisa ter **Hc** (altura comercial).")
-        st.stop()
+        raise ValueError("A planilha precisa ter **Hc** (altura comercial).")
     if not (col_dap or col_cap):
-        st.error("A planilha precisa ter **DAP** ou **CAP**.")
-        st.stop()
+        raise ValueError("A planilha precisa ter **DAP** ou **CAP**.")
 
-    df = df_raw.copy()
+    # Cópia rasa: com copy-on-write, os dados de df_raw são compartilhados
+    # e só as colunas novas/alteradas alocam memória (df_raw fica intacto).
+    df = df_raw.copy(deep=False)
 
     # DAP (cm)
     if col_dap:
@@ -134,33 +180,70 @@ def process_dataframe(df_raw: pd.DataFrame) -> pd.DataFrame:
 
     # Checagens
     if df["DAP"].isna().all():
-        st.error("Todos os valores de DAP ficaram inválidos. Confira DAP/CAP.")
-        st.stop()
+        raise ValueError("Todos os valores de DAP ficaram inválidos. Confira DAP/CAP.")
     if df["Hc"].isna().all():
-        st.error("Todos os valores de Hc ficaram inválidos. Confira a coluna Hc.")
-        st.stop()
-
-    # Área basal (m²): π * ( (DAP/100)/2 )²
-    df["g_m2"] = math.pi * ((df["DAP"] / 100.0) / 2.0) ** 2
-
-    # Volume (m³) com Hc — fórmula do usuário
-    # Volume = 1,3332 * ((DAP/100) ** 2,0836) * (Hc ** 0,732)
-    df["Vol_Hc_m3"] = 1.3332 * ((df["DAP"] / 100.0) ** 2.0836) * (df["Hc"] ** 0.732)
+        raise ValueError("Todos os valores de Hc ficaram inválidos. Confira a coluna Hc.")
+
+    # Kernel numérico: extrai DAP/Hc para NumPy uma única vez e deriva
+    # g e volume dos mesmos arrays (sem Series intermediárias).
+    dap_arr = df["DAP"].to_numpy(dtype=float)
+    hc_arr = df["Hc"].to_numpy(dtype=float)
+
+    # Área basal (m²): K_G * DAP² (uma multiplicação + uma potência,
+    # sem as duas divisões intermediárias)
+    df["g_m2"] = K_G * dap_arr ** 2
+
+    # Volume (m³) com Hc — fórmula do usuário, vetorizada via NumPy
+    vol = vol_vec(dap_arr, hc_arr)
+    df["Vol_Hc_m3"] = vol
+
+    # Escore Z do volume: (média - vol) / soma, em uma cadeia de ufuncs.
+    # Denominador inválido (soma zero ou não finita) vira NaN para a
+    # coluna inteira, sem testes escalares por linha.
+    vol_validos = vol[np.isfinite(vol)]
+    if vol_validos.size:
+        soma_vol = vol_validos.sum()
+        den = soma_vol if np.isfinite(soma_vol) and soma_vol != 0 else np.nan
+        df["Escore Z"] = (vol_validos.mean() - vol) / den
+    else:
+        df["Escore Z"] = np.nan
 
     # Metadados úteis (se existirem)
     if col_niv:
-        df["Nível"] = df[col_niv]
+        # Poucos níveis repetidos em muitas linhas: categórico reduz a
+        # memória e acelera o hashing do groupby do resumo.
+        df["Nível"] = df[col_niv].astype("category")
     if col_esp:
         df["Espécie"] = df[col_esp]
     if col_pf:
         df["PF"] = df[col_pf]
 
     # Ordena colunas principais primeiro
-    cols_first = ["PF", "Nível", "Espécie", "DAP", "Hc", "g_m2", "Vol_Hc_m3"]
+    cols_first = ["PF", "Nível", "Espécie", "DAP", "Hc", "g_m2", "Vol_Hc_m3", "Escore Z"]
     ordered = [c for c in cols_first if c in df.columns] + [c for c in df.columns if c not in cols_first]
-    df = df[ordered]
-
-    return df
+    # reindex só reorganiza os rótulos; com copy-on-write os blocos de
+    # dados são compartilhados, sem reconstruir o frame inteiro.
+    return df.reindex(columns=ordered)
+
+
+def histograma_dap(dap: np.ndarray) -> pd.DataFrame:
+    """Frequência de DAP por classe (Sturges), pronta para st.bar_chart.
+
+    Puro NumPy (sem Matplotlib): o array é extraído uma única vez e as
+    bordas vêm de np.linspace, evitando a classe extra que np.arange cria
+    por deriva de ponto flutuante.
+    """
+    dap = np.asarray(dap, dtype=float)
+    dap = dap[np.isfinite(dap)]
+    if dap.size == 0:
+        return pd.DataFrame()
+    xmin, xmax = dap.min(), dap.max()
+    if xmin == xmax:
+        counts, edges = np.histogram(dap, bins=1)
+    else:
+        k = max(1, int(round(1 + 3.322 * math.log10(dap.size))))
+        counts, edges = np.histogram(dap, bins=np.linspace(xmin, xmax, k + 1))
+    return pd.DataFrame({"freq": counts}, index=edges[:-1].round(2))
 
 
 def resumo_por_nivel(df: pd.DataFrame) -> pd.DataFrame:
@@ -178,7 +261,7 @@ def resumo_por_nivel(df: pd.DataFrame) -> pd.DataFrame:
         res.index = ["Geral"]
         return res.reset_index(names="Nível/Grupo")
 
-    grp = df.groupby("Nível", dropna=False)
+    grp = df.groupby("Nível", dropna=False, observed=True)
     res = grp.agg(
         n_indivíduos=("DAP", "size"),
         DAP_médio_cm=("DAP", "mean"),
@@ -188,10 +271,37 @@ def resumo_por_nivel(df: pd.DataFrame) -> pd.DataFrame:
     return res
 
 
+@st.cache_data(show_spinner=False)
+def process_all(file_bytes: bytes) -> tuple:
+    """Pipeline completo (leitura → processamento → resumo), memoizado.
+
+    Com o cache keyado nos bytes do upload, interações com widgets
+    (ex.: botões de download) não recomputam nada — só um novo arquivo
+    dispara o reprocessamento.
+    """
+    xl = load_xlsx(file_bytes)
+    df_in = _first_sheet_or_named(xl)
+    df_proc = process_dataframe(df_in)
+    res_nivel = resumo_por_nivel(df_proc)
+    return df_proc, res_nivel
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
 def download_xlsx(dfs: dict, filename: str) -> bytes:
-    """Cria um .xlsx em memória com várias abas."""
+    """Cria um .xlsx em memória com várias abas.
+
+    Usa xlsxwriter (serialização em C, mais rápido que o openpyxl) quando
+    disponível; senão, volta ao openpyxl. Sem constant_memory: o to_excel
+    do pandas escreve coluna a coluna, e o modo streaming descarta células
+    fora de ordem. Os bytes são memoizados pelo conteúdo dos DataFrames —
+    reruns e novos cliques de download não reserializam a mesma planilha.
+    """
     buffer = io.BytesIO()
-    with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
+    try:
+        writer = pd.ExcelWriter(buffer, engine="xlsxwriter")
+    except ImportError:
+        writer = pd.ExcelWriter(buffer, engine="openpyxl")
+    with writer:
         for sheet, df in dfs.items():
             df.to_excel(writer, sheet_name=sheet[:31], index=False)
     buffer.seek(0)
@@ -202,15 +312,14 @@ def download_xlsx(dfs: dict, filename: str) -> bytes:
 # -----------------------------------------------------------------------------
 if file:
     try:
-        xl = pd.read_excel(file, sheet_name=None)  # carrega todas as abas
-        df_in = _first_sheet_or_named(xl)
+        df_proc, res_nivel = process_all(file.getvalue())
+    except ValueError as e:
+        st.error(str(e))
+        st.stop()
     except Exception as e:
         st.error(f"Falha ao ler o Excel: {e}")
         st.stop()
 
-    df_proc = process_dataframe(df_in)
-    res_nivel = resumo_por_nivel(df_proc)
-
     st.success("Processado com sucesso (usando Hc).")
     st.write("Prévia dos dados:")
     st.dataframe(df_proc.head(50), use_container_width=True)
@@ -231,6 +340,15 @@ if file:
 
     st.divider()
 
+    st.subheader("Distribuição de DAP")
+    hist_dap = histograma_dap(df_proc["DAP"].to_numpy())
+    if hist_dap.empty:
+        st.caption("Sem valores válidos de DAP para o histograma.")
+    else:
+        st.bar_chart(hist_dap)
+
+    st.divider()
+
     # Exports
     xlsx_bytes = download_xlsx(
         {